@@ -5,3 +5,4 @@ from . import models
 from . import pydantic
 from . import clients
 from . import llm
+from . import cache
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import threading
+from functools import wraps
+from typing import Callable, List, Optional
+import numpy as np
+from numpy.typing import NDArray
+import faiss
+
+# on-disk cache of successful LLM responses, disabled until enable_cache is called
+_cache = None
+# semantic layer on top of _cache, disabled until enable_semantic_cache is called
+_semantic_cache = None
+
+
+class SemanticCache:
+    """
+    An in-memory nearest neighbor index over prompt embeddings, pointing at entries of the on-disk cache.
+
+    Each namespace (model, args and system prompt) gets its own index, so responses are only reused
+    for calls that differ in their prompt alone.
+
+    Attributes:
+        embed_fn (Callable[[List[str]], NDArray[np.float32]]): A function that returns the embeddings of a list of strings.
+        threshold (float): The minimum cosine similarity between two prompts for a response to be reused.
+        max_entries (int): The maximum number of prompts indexed per namespace, oldest are evicted first.
+    """
+
+    def __init__(self,
+                 embed_fn: Callable[[List[str]], NDArray[np.float32]],
+                 threshold: float = 0.97,
+                 max_entries: int = 100_000):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.indexes = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def embed(self, prompt: str) -> NDArray[np.float32]:
+        embedding = np.asarray(self.embed_fn([prompt]), dtype=np.float32)
+        faiss.normalize_L2(embedding)
+        return embedding
+
+    def search(self, namespace: str, embedding: NDArray[np.float32]) -> Optional[str]:
+        """
+        Returns the cache key of the most similar prompt in the namespace, if it's above the threshold.
+        """
+        with self.lock:
+            index = self.indexes.get(namespace)
+            if index is None or index.ntotal == 0:
+                return None
+            D, I = index.search(embedding, 1)
+            if D[0][0] < self.threshold:
+                return None
+            return self.keys[namespace][I[0][0]]
+
+    def add(self, namespace: str, embedding: NDArray[np.float32], key: str):
+        with self.lock:
+            if namespace not in self.indexes:
+                self.indexes[namespace] = faiss.IndexFlatIP(
+                    embedding.shape[1])
+                self.keys[namespace] = []
+            index = self.indexes[namespace]
+            keys = self.keys[namespace]
+            if index.ntotal >= self.max_entries:
+                num_evicted = index.ntotal - self.max_entries + 1
+                index.remove_ids(faiss.IDSelectorRange(0, num_evicted))
+                del keys[:num_evicted]
+            index.add(embedding)
+            keys.append(key)
+
+
+def enable_cache(directory: str = ".superpipe_cache", size_limit: int = 2**30):
+    """
+    Enables caching of successful LLM responses on disk. Requires the `diskcache` package.
+
+    Args:
+        directory (str, optional): The directory to store the cache in. Defaults to ".superpipe_cache".
+        size_limit (int, optional): The maximum size of the cache in bytes, least recently used responses are evicted first. Defaults to 1GB.
+    """
+    global _cache
+    from diskcache import Cache
+    disable_cache()
+    _cache = Cache(directory, size_limit=size_limit,
+                   eviction_policy="least-recently-used")
+
+
+def enable_semantic_cache(embed_fn: Callable[[List[str]], NDArray[np.float32]],
+                          threshold: float = 0.97,
+                          max_entries: int = 100_000):
+    """
+    Enables reusing cached responses for prompts that are semantically similar to a previous prompt
+    for the same model and args, not just identical. The on-disk cache must be enabled first.
+
+    Args:
+        embed_fn (Callable[[List[str]], NDArray[np.float32]]): A function that returns the embeddings of a list of strings.
+            Should be cheap compared to an LLM call, e.g. a small local embedding model.
+        threshold (float, optional): The minimum cosine similarity between two prompts for a response to be reused. Defaults to 0.97.
+        max_entries (int, optional): The maximum number of prompts indexed per model. Defaults to 100,000.
+    """
+    global _semantic_cache
+    if _cache is None:
+        raise ValueError(
+            "The cache must be enabled with enable_cache before enabling the semantic cache")
+    _semantic_cache = SemanticCache(embed_fn, threshold, max_entries)
+
+
+def disable_cache():
+    """
+    Disables caching of LLM responses, including the semantic cache.
+    """
+    global _cache, _semantic_cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+    _semantic_cache = None
+
+
+def cache_key(model: str, prompt: str, args={}, *extra) -> str:
+    """
+    Returns the cache key for an LLM call, a hash of the model, prompt, args and any extra arguments (e.g. system prompt).
+    """
+    serialized_args = json.dumps(args, sort_keys=True, default=str)
+    payload = "|".join([model, prompt, serialized_args, *map(str, extra)])
+    return hashlib.blake2b(payload.encode(), digest_size=32).hexdigest()
+
+
+def _from_cache(response):
+    # cache hits don't hit the API, so they're free and instant
+    response.latency = 0.0
+    response.input_cost = 0.0
+    response.output_cost = 0.0
+    response.from_cache = True
+    return response
+
+
+def _lookup(prompt, model, args, extra):
+    """
+    Returns (cached response or None, key, namespace, embedding) for an LLM call.
+    """
+    key = cache_key(model, prompt, args, *extra)
+    response = _cache.get(key)
+    if response is not None or _semantic_cache is None:
+        return response, key, None, None
+    namespace = cache_key(model, "", args, *extra)
+    embedding = _semantic_cache.embed(prompt)
+    similar_key = _semantic_cache.search(namespace, embedding)
+    if similar_key is not None:
+        response = _cache.get(similar_key)
+    return response, key, namespace, embedding
+
+
+def _store(response, key, namespace, embedding):
+    if not response.success:
+        return
+    _cache.set(key, response)
+    if namespace is not None and _semantic_cache is not None:
+        _semantic_cache.add(namespace, embedding, key)
+
+
+def cached(fn):
+    """
+    Decorator that caches successful responses of an LLM call with signature `(prompt, model, args, *extra)`,
+    sync or async. Does nothing unless the cache is enabled.
+    """
+    signature = inspect.signature(fn)
+
+    def bind(*a, **kw):
+        bound = signature.bind(*a, **kw)
+        bound.apply_defaults()
+        prompt, model, args, *extra = bound.arguments.values()
+        return prompt, model, args, extra
+
+    if inspect.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def async_wrapper(*a, **kw):
+            if _cache is None:
+                return await fn(*a, **kw)
+            prompt, model, args, extra = bind(*a, **kw)
+            # disk reads and embeddings would block the event loop
+            response, *entry = await asyncio.to_thread(_lookup, prompt, model, args, extra)
+            if response is not None:
+                return _from_cache(response)
+            response = await fn(*a, **kw)
+            await asyncio.to_thread(_store, response, *entry)
+            return response
+
+        return async_wrapper
+
+    @wraps(fn)
+    def wrapper(*a, **kw):
+        if _cache is None:
+            return fn(*a, **kw)
+        prompt, model, args, extra = bind(*a, **kw)
+        response, *entry = _lookup(prompt, model, args, extra)
+        if response is not None:
+            return _from_cache(response)
+        response = fn(*a, **kw)
+        _store(response, *entry)
+        return response
+
+    return wrapper
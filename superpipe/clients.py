@@ -1,24 +1,42 @@
+import asyncio
+import importlib.util
+import weakref
+import httpx
 import requests
 import os
-from openai import OpenAI
-from anthropic import Anthropic
+from openai import OpenAI, AsyncOpenAI
+from anthropic import Anthropic, AsyncAnthropic
 from superpipe.models import *
 
 # TODO: add support for non-openai providers
 
 client_for_model = {}
-openrouter_models = []
+openrouter_models = set()
+# connections are pooled per provider client, using HTTP/2 if the h2 package is installed
+http2_available = importlib.util.find_spec("h2") is not None
+http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+# async clients are bound to the event loop they were created in, so they're kept per loop
+async_clients_for_loop = weakref.WeakKeyDictionary()
+
+
+def _http_client():
+    return httpx.Client(http2=http2_available, limits=http_limits)
+
+
+def _async_http_client():
+    return httpx.AsyncClient(http2=http2_available, limits=http_limits)
 
 
 def init_openai(api_key, base_url=None):
-    openai_client = OpenAI(api_key=api_key, base_url=base_url)
+    openai_client = OpenAI(
+        api_key=api_key, base_url=base_url, http_client=_http_client())
     client_for_model[gpt35] = openai_client
     client_for_model[gpt4] = openai_client
     client_for_model[gpt4o] = openai_client
 
 
 def init_anthropic(api_key):
-    anthropic_client = Anthropic(api_key=api_key)
+    anthropic_client = Anthropic(api_key=api_key, http_client=_http_client())
     client_for_model[claude3_haiku] = anthropic_client
     client_for_model[claude3_sonnet] = anthropic_client
     client_for_model[claude3_opus] = anthropic_client
@@ -26,16 +44,19 @@ def init_anthropic(api_key):
 
 def init_openrouter(api_key):
     base_url = "https://openrouter.ai/api/v1"
-    openrouter_client = OpenAI(api_key=api_key, base_url=base_url)
+    openrouter_client = OpenAI(
+        api_key=api_key, base_url=base_url, http_client=_http_client())
     models_json = requests.get(f"{base_url}/models").json()
-    openrouter_models.extend([model['id'] for model in models_json['data']])
+    model_ids = [model['id'] for model in models_json['data']]
+    # a set, since it's checked on every LLM call
+    openrouter_models.update(model_ids)
     pricing_list = [(model['pricing']['prompt'], model['pricing']
                      ['completion']) for model in models_json['data']]
     pricing_list = [(float(p[0])*1e6, float(p[1])*1e6) if float(p[0]) > 0 else (0, 0)
                     for p in pricing_list]
-    for i, model in enumerate(openrouter_models):
+    for model, pricing in zip(model_ids, pricing_list):
         client_for_model[model] = openrouter_client
-        set_pricing({model: pricing_list[i]})
+        set_pricing({model: pricing})
 
 
 def get_client(model):
@@ -57,7 +78,57 @@ def get_client(model):
     return client_for_model.get(model)
 
 
+def has_async_client(model):
+    """
+    Returns whether `get_async_client` can create an async client configured like the model's sync client.
+    Only plain OpenAI and Anthropic clients can be copied, not e.g. AzureOpenAI clients set in `client_for_model`.
+    """
+    return type(get_client(model)) in (OpenAI, Anthropic)
+
+
+def get_async_client(model):
+    """
+    Returns an async client for the model, configured like the sync client returned by `get_client`.
+    Must be called from within a running event loop. Returns None unless `has_async_client(model)`.
+    """
+    client = get_client(model)
+    if type(client) not in (OpenAI, Anthropic):
+        return None
+    clients = async_clients_for_loop.setdefault(
+        asyncio.get_running_loop(), {})
+    if id(client) not in clients:
+        options = dict(
+            api_key=client.api_key,
+            base_url=client.base_url,
+            timeout=client.timeout,
+            default_headers=client._custom_headers,
+            default_query=client._custom_query)
+        if isinstance(client, Anthropic):
+            async_client_class = AsyncAnthropic
+            options["auth_token"] = client.auth_token
+        else:
+            async_client_class = AsyncOpenAI
+            options["organization"] = client.organization
+            # only in newer versions of the openai package
+            if getattr(client, "project", None) is not None:
+                options["project"] = client.project
+        # retries are handled by the caller
+        clients[id(client)] = async_client_class(
+            **options, max_retries=0, http_client=_async_http_client())
+    return clients[id(client)]
+
+
+async def close_async_clients():
+    """
+    Closes the async clients created in the running event loop.
+    """
+    clients = async_clients_for_loop.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
 def set_client_for_model(model, api_key, base_url, pricing=None):
-    client_for_model[model] = OpenAI(api_key=api_key, base_url=base_url)
+    client_for_model[model] = OpenAI(
+        api_key=api_key, base_url=base_url, http_client=_http_client())
     if pricing is not None:
         set_pricing({model: pricing})
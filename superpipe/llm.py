@@ -1,13 +1,44 @@
+import asyncio
+import random
 import time
-import json
-from pydantic import BaseModel
-from typing import Optional
+from contextlib import contextmanager
+from functools import lru_cache
+import openai
+import anthropic
+from dataclasses import dataclass, field
+from typing import List, Optional
 from openai.types.chat.completion_create_params import CompletionCreateParamsNonStreaming
 from superpipe.models import *
-from superpipe.clients import get_client, openrouter_models
+from superpipe.clients import get_client, get_async_client, has_async_client, openrouter_models
+from superpipe.cache import cached
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-class LLMResponse(BaseModel):
+_JSON_SYSTEM_PROMPT = "You are a helpful assistant designed to output JSON."
+_ANTHROPIC_JSON_SYSTEM_PROMPT = "You are a helpful assistant designed to output JSON. Return only JSON, nothing else."
+# shared between calls, must not be mutated
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+_anthropic_models = frozenset({claude3_haiku, claude3_sonnet, claude3_opus})
+
+_BATCH_PROMPT = """Answer each of the following {n} queries independently.
+
+{queries}
+
+Return a JSON object with a single key "answers", a list of {n} strings where the i-th string is the answer to query i, in order."""
+
+# retries for async calls that are rate limited or fail with a server/connection error
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+
+
+# plain slotted dataclasses rather than pydantic models since one is created per LLM call,
+# and all fields are set from already typed provider responses
+@dataclass(slots=True)
+class LLMResponse:
     input_tokens: int = 0
     output_tokens: int = 0
     input_cost: float = 0.0
@@ -16,10 +47,36 @@ class LLMResponse(BaseModel):
     error: Optional[str] = None
     latency: float = 0.0
     content: str = ""
+    from_cache: bool = False
 
 
+@dataclass(slots=True)
 class StructuredLLMResponse(LLMResponse):
-    content: dict = {}
+    content: dict = field(default_factory=dict)
+
+
+@lru_cache(maxsize=32)
+def _system_message(system: str) -> dict:
+    # shared between calls, must not be mutated
+    return {"role": "system", "content": system}
+
+
+def _messages(prompt: str, system: str = None) -> list:
+    if system is None:
+        return [{"role": "user", "content": prompt}]
+    return [_system_message(system), {"role": "user", "content": prompt}]
+
+
+@contextmanager
+def _timed(response: LLMResponse):
+    """
+    Sets the latency of the response to the time spent in the block, even if it raises.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        response.latency = time.perf_counter() - start_time
 
 
 def get_llm_response(
@@ -28,11 +85,10 @@ def get_llm_response(
         args={}) -> LLMResponse:
     if model in openrouter_models:
         return get_llm_response_openrouter(prompt, model, args)
-    if model in [claude3_haiku, claude3_sonnet, claude3_opus]:
-        return get_llm_response_anthropic(prompt, model, args)
-    return get_llm_response_openai(prompt, model, args)
+    return _dispatch.get(model, get_llm_response_openai)(prompt, model, args)
 
 
+@cached
 def get_llm_response_openrouter(
         prompt: str,
         model: str = "openrouter/auto",
@@ -44,18 +100,13 @@ def get_llm_response_openrouter(
     if client is None:
         raise ValueError("Unsupported model: ", model)
     try:
-        messages = []
-        if system is not None:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
-        start_time = time.perf_counter()
-        res = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **args
-        )
-        end_time = time.perf_counter()
-        response.latency = end_time - start_time
+        messages = _messages(prompt, system)
+        with _timed(response):
+            res = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **args
+            )
         response.input_tokens = res.usage.prompt_tokens
         response.output_tokens = res.usage.completion_tokens
         response.input_cost, response.output_cost = get_cost(
@@ -76,6 +127,7 @@ def get_structured_llm_response_openrouter(
     return get_llm_response_openrouter(prompt, model, system, args)
 
 
+@cached
 def get_llm_response_anthropic(
         prompt: str,
         model: str = claude3_haiku,
@@ -87,15 +139,13 @@ def get_llm_response_anthropic(
         raise ValueError(f"""Unsupported model: {model}. Currently Superpipe only supports OpenAI, Anthropic and OpenRouter models.
                          If you're trying to use a supported model, you might be missing the appropriate api key.""")
     try:
-        start_time = time.perf_counter()
-        res = client.messages.create(
-            model=model,
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}],
-            **args
-        )
-        end_time = time.perf_counter()
-        response.latency = end_time - start_time
+        with _timed(response):
+            res = client.messages.create(
+                model=model,
+                max_tokens=4096,
+                messages=[{"role": "user", "content": prompt}],
+                **args
+            )
         response.input_tokens = res.usage.input_tokens
         response.output_tokens = res.usage.output_tokens
         response.input_cost, response.output_cost = get_cost(
@@ -108,6 +158,7 @@ def get_llm_response_anthropic(
     return response
 
 
+@cached
 def get_llm_response_openai(
         prompt: str,
         model=gpt35,
@@ -119,18 +170,13 @@ def get_llm_response_openai(
     if client is None:
         raise ValueError("Unsupported model: ", model)
     try:
-        messages = []
-        if system is not None:
-            messages.append({"role": "system", "content": system})
-        messages.append({"role": "user", "content": prompt})
-        start_time = time.perf_counter()
-        res = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **args
-        )
-        end_time = time.perf_counter()
-        response.latency = end_time - start_time
+        messages = _messages(prompt, system)
+        with _timed(response):
+            res = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **args
+            )
         response.input_tokens = res.usage.prompt_tokens
         response.output_tokens = res.usage.completion_tokens
         response.input_cost, response.output_cost = get_cost(
@@ -147,9 +193,8 @@ def get_structured_llm_response(
         prompt: str,
         model: str = gpt35,
         args={}) -> StructuredLLMResponse:
-    if model in [claude3_haiku, claude3_sonnet, claude3_opus]:
-        return get_structured_llm_response_anthropic(prompt, model, args)
-    return get_structured_llm_response_openai(prompt, model, args)
+    return _structured_dispatch.get(
+        model, get_structured_llm_response_openai)(prompt, model, args)
 
 
 def get_structured_llm_response_openrouter(
@@ -157,19 +202,10 @@ def get_structured_llm_response_openrouter(
         model: str = "openrouter/auto",
         args={}) -> StructuredLLMResponse:
     print("Warning: Not all OpenRouter models support structured output, this may cause unexpected issues.")
-    system = "You are a helpful assistant designed to output JSON."
-    updated_args = {**args, "response_format": {"type": "json_object"}}
+    system = _JSON_SYSTEM_PROMPT
+    updated_args = {**args, "response_format": _JSON_RESPONSE_FORMAT}
     response = get_llm_response_openrouter(prompt, model, updated_args, system)
-    return StructuredLLMResponse(
-        input_tokens=response.input_tokens,
-        output_tokens=response.output_tokens,
-        input_cost=response.input_cost,
-        output_cost=response.output_cost,
-        success=response.success,
-        error=response.error,
-        latency=response.latency,
-        content=json.loads(response.content) if response.success else {},
-    )
+    return _to_structured_response(response)
 
 
 def get_structured_llm_response_anthropic(
@@ -179,7 +215,7 @@ def get_structured_llm_response_anthropic(
     print("Warning: Anthropic models do not support structured output, this may cause unexpected issues.")
     updated_args = {
         **args,
-        "system": "You are a helpful assistant designed to output JSON. Return only JSON, nothing else."
+        "system": _ANTHROPIC_JSON_SYSTEM_PROMPT
     }
     return get_llm_response_anthropic(
         prompt,
@@ -191,9 +227,13 @@ def get_structured_llm_response_openai(
         prompt: str,
         model=gpt35,
         args: CompletionCreateParamsNonStreaming = {}) -> StructuredLLMResponse:
-    system = "You are a helpful assistant designed to output JSON."
-    updated_args = {**args, "response_format": {"type": "json_object"}}
+    system = _JSON_SYSTEM_PROMPT
+    updated_args = {**args, "response_format": _JSON_RESPONSE_FORMAT}
     response = get_llm_response_openai(prompt, model, updated_args, system)
+    return _to_structured_response(response)
+
+
+def _to_structured_response(response: LLMResponse) -> StructuredLLMResponse:
     return StructuredLLMResponse(
         input_tokens=response.input_tokens,
         output_tokens=response.output_tokens,
@@ -202,5 +242,313 @@ def get_structured_llm_response_openai(
         success=response.success,
         error=response.error,
         latency=response.latency,
-        content=json.loads(response.content) if response.success else {},
+        content=json_loads(response.content) if response.success else {},
+        from_cache=response.from_cache,
     )
+
+
+def get_llm_response_batch(
+        prompts: List[str],
+        model: str = gpt35,
+        args={},
+        max_batch_size: int = 20,
+        max_batch_tokens: int = 4000) -> List[LLMResponse]:
+    """
+    Gets a response for each prompt using fewer requests, by packing up to `max_batch_size` prompts
+    (and at most `max_batch_tokens` prompt tokens) into each request and splitting the answers back out.
+
+    The token counts, cost and latency of each request are apportioned to its prompts by length.
+    Only suitable for independent prompts with short answers, since the model sees all prompts in a batch at once.
+
+    Args:
+        prompts (List[str]): The prompts to get responses for.
+        model (str, optional): The model to use. Defaults to gpt35.
+        args (dict, optional): Additional arguments to pass to the API.
+        max_batch_size (int, optional): The maximum number of prompts per request. Defaults to 20.
+        max_batch_tokens (int, optional): The maximum number of prompt tokens per request, counted with tiktoken
+            if it's installed (`pip install superpipe-py[tiktoken]`) and estimated otherwise. A longer prompt is sent in a request on its own. Defaults to 4000.
+
+    Returns:
+        List[LLMResponse]: One response per prompt, in order.
+    """
+    responses = []
+    batch, batch_tokens = [], 0
+    for prompt in prompts:
+        num_tokens = _count_tokens(prompt, model)
+        if len(batch) > 0 and (len(batch) == max_batch_size or
+                               batch_tokens + num_tokens > max_batch_tokens):
+            responses.extend(_get_batch_response(batch, model, args))
+            batch, batch_tokens = [], 0
+        batch.append(prompt)
+        batch_tokens += num_tokens
+    if len(batch) > 0:
+        responses.extend(_get_batch_response(batch, model, args))
+    return responses
+
+
+def _count_tokens(text: str, model: str) -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # roughly 4 characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _fractions(weights: List[float]) -> List[float]:
+    """
+    Normalizes `weights` to fractions that sum to 1, splitting evenly if they're all zero.
+    """
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        return [1 / len(weights)] * len(weights)
+    return [weight / weight_sum for weight in weights]
+
+
+def _apportion(total: int, fractions: List[float]) -> List[int]:
+    """
+    Splits `total` into integers proportional to `fractions` that sum to `total`, using the largest remainder method.
+    """
+    quotas = [total * fraction for fraction in fractions]
+    shares = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(quotas)),
+                          key=lambda i: quotas[i] - shares[i], reverse=True)
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _get_batch_response(prompts: List[str], model: str, args) -> List[LLMResponse]:
+    queries = "\n\n".join(
+        f"### Query {i+1}\n{prompt}" for i, prompt in enumerate(prompts))
+    batch_prompt = _BATCH_PROMPT.format(n=len(prompts), queries=queries)
+    try:
+        response = get_structured_llm_response(batch_prompt, model, args)
+    except Exception as e:
+        response = StructuredLLMResponse(success=False, error=str(e))
+    answers = None
+    error = response.error
+    if response.success:
+        answers = _parse_batch_answers(response.content, len(prompts))
+        if answers is None:
+            error = f"Expected a list of {len(prompts)} answers, got: {response.content}"
+
+    # tokens, cost and latency are all split with the same fractions, so they add up to the request's
+    input_fractions = _fractions([len(prompt) for prompt in prompts])
+    output_fractions = _fractions(
+        [len(answer) for answer in answers] if answers is not None else [1] * len(prompts))
+    input_tokens = _apportion(response.input_tokens, input_fractions)
+    output_tokens = _apportion(response.output_tokens, output_fractions)
+    responses = []
+    for i in range(len(prompts)):
+        responses.append(LLMResponse(
+            input_tokens=input_tokens[i],
+            output_tokens=output_tokens[i],
+            input_cost=response.input_cost * input_fractions[i],
+            output_cost=response.output_cost * output_fractions[i],
+            success=answers is not None,
+            error=error,
+            latency=response.latency * input_fractions[i],
+            content=answers[i] if answers is not None else "",
+            from_cache=response.from_cache,
+        ))
+    return responses
+
+
+def _parse_batch_answers(content, num_prompts: int) -> Optional[List[str]]:
+    if not isinstance(content, dict):
+        try:
+            content = json_loads(content)
+        except ValueError:
+            return None
+    answers = content.get("answers") if isinstance(content, dict) else None
+    if not isinstance(answers, list) or len(answers) != num_prompts:
+        return None
+    return [str(answer) for answer in answers]
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.APIConnectionError, anthropic.APIConnectionError)):
+        return True
+    status_code = getattr(e, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+async def _with_retries(create):
+    """
+    Awaits `create()`, retrying with exponential backoff and jitter on rate limits and server errors.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await create()
+        except Exception as e:
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+
+async def get_llm_response_async(
+        prompt: str,
+        model: str = gpt35,
+        args={}) -> LLMResponse:
+    """
+    Async version of `get_llm_response`. Retries rate limited calls and uses the response cache if enabled.
+    Models whose client can't be copied to an async client (see `has_async_client`) are called with
+    `get_llm_response` in a thread instead.
+    """
+    if not has_async_client(model):
+        return await asyncio.to_thread(get_llm_response, prompt, model, args)
+    if model in openrouter_models:
+        return await get_llm_response_openrouter_async(prompt, model, args)
+    return await _async_dispatch.get(
+        model, get_llm_response_openai_async)(prompt, model, args)
+
+
+@cached
+async def get_llm_response_openrouter_async(
+        prompt: str,
+        model: str = "openrouter/auto",
+        args={},
+        system: str = None,) -> LLMResponse:
+    response = LLMResponse()
+    res = None
+    client = get_async_client(model)
+    if client is None:
+        raise ValueError("Unsupported model: ", model)
+    try:
+        messages = _messages(prompt, system)
+        with _timed(response):
+            res = await _with_retries(lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **args
+            ))
+        response.input_tokens = res.usage.prompt_tokens
+        response.output_tokens = res.usage.completion_tokens
+        response.input_cost, response.output_cost = get_cost(
+            response.input_tokens, response.output_tokens, model)
+        response.content = res.choices[0].message.content
+        response.success = True
+    except Exception as e:
+        response.success = False
+        response.error = str(e)
+    return response
+
+
+@cached
+async def get_llm_response_anthropic_async(
+        prompt: str,
+        model: str = claude3_haiku,
+        args={}) -> LLMResponse:
+    response = LLMResponse()
+    res = None
+    client = get_async_client(model)
+    if client is None:
+        raise ValueError(f"""Unsupported model: {model}. Currently Superpipe only supports OpenAI, Anthropic and OpenRouter models.
+                         If you're trying to use a supported model, you might be missing the appropriate api key.""")
+    try:
+        with _timed(response):
+            res = await _with_retries(lambda: client.messages.create(
+                model=model,
+                max_tokens=4096,
+                messages=[{"role": "user", "content": prompt}],
+                **args
+            ))
+        response.input_tokens = res.usage.input_tokens
+        response.output_tokens = res.usage.output_tokens
+        response.input_cost, response.output_cost = get_cost(
+            response.input_tokens, response.output_tokens, model)
+        response.content = res.content[0].text
+        response.success = True
+    except Exception as e:
+        response.success = False
+        response.error = str(e)
+    return response
+
+
+@cached
+async def get_llm_response_openai_async(
+        prompt: str,
+        model=gpt35,
+        args: CompletionCreateParamsNonStreaming = {},
+        system: str = None,) -> LLMResponse:
+    response = LLMResponse()
+    res = None
+    client = get_async_client(model)
+    if client is None:
+        raise ValueError("Unsupported model: ", model)
+    try:
+        messages = _messages(prompt, system)
+        with _timed(response):
+            res = await _with_retries(lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **args
+            ))
+        response.input_tokens = res.usage.prompt_tokens
+        response.output_tokens = res.usage.completion_tokens
+        response.input_cost, response.output_cost = get_cost(
+            response.input_tokens, response.output_tokens, model)
+        response.content = res.choices[0].message.content
+        response.success = True
+    except Exception as e:
+        response.success = False
+        response.error = str(e)
+    return response
+
+
+async def get_structured_llm_response_async(
+        prompt: str,
+        model: str = gpt35,
+        args={}) -> StructuredLLMResponse:
+    """
+    Async version of `get_structured_llm_response`.
+    """
+    if not has_async_client(model):
+        return await asyncio.to_thread(get_structured_llm_response, prompt, model, args)
+    return await _structured_async_dispatch.get(
+        model, get_structured_llm_response_openai_async)(prompt, model, args)
+
+
+async def get_structured_llm_response_anthropic_async(
+        prompt: str,
+        model: str = claude3_haiku,
+        args={}) -> StructuredLLMResponse:
+    print("Warning: Anthropic models do not support structured output, this may cause unexpected issues.")
+    updated_args = {
+        **args,
+        "system": _ANTHROPIC_JSON_SYSTEM_PROMPT
+    }
+    return await get_llm_response_anthropic_async(prompt, model, updated_args)
+
+
+async def get_structured_llm_response_openai_async(
+        prompt: str,
+        model=gpt35,
+        args: CompletionCreateParamsNonStreaming = {}) -> StructuredLLMResponse:
+    system = _JSON_SYSTEM_PROMPT
+    updated_args = {**args, "response_format": _JSON_RESPONSE_FORMAT}
+    response = await get_llm_response_openai_async(prompt, model, updated_args, system)
+    return _to_structured_response(response)
+
+
+# provider-specific functions for models that aren't served through the OpenAI client
+_dispatch = {m: get_llm_response_anthropic for m in _anthropic_models}
+_structured_dispatch = {
+    m: get_structured_llm_response_anthropic for m in _anthropic_models}
+_async_dispatch = {
+    m: get_llm_response_anthropic_async for m in _anthropic_models}
+_structured_async_dispatch = {
+    m: get_structured_llm_response_anthropic_async for m in _anthropic_models}
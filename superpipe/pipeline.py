@@ -1,19 +1,21 @@
 import pickle
 import hashlib
-from typing import List, Callable, Union, Dict, Optional
-from collections import defaultdict
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Callable, Union, Dict, Optional, Set
 from dataclasses import dataclass, field
 import pandas as pd
+import numpy as np
 from prettytable import PrettyTable
-from superpipe.steps import Step, LLMStep, LLMStructuredStep, LLMStructuredCompositeStep
+from superpipe.steps import Step, LLMStep, DEFAULT_CONCURRENCY
 from superpipe.config import is_dev, studio_enabled
 
 
 @dataclass
 class PipelineStatistics:
     score: Optional[float] = None
-    input_tokens: dict = field(default_factory=lambda: defaultdict(int))
-    output_tokens: dict = field(default_factory=lambda: defaultdict(int))
+    input_tokens: dict = field(default_factory=dict)
+    output_tokens: dict = field(default_factory=dict)
     input_cost: float = 0.0
     output_cost: float = 0.0
     num_success: int = 0
@@ -25,10 +27,8 @@ class PipelineStatistics:
         table.header = False
         if self.score is not None:
             table.add_row(["score", str(self.score)], divider=True)
-        table.add_row(["input_tokens", str(
-            dict(self.input_tokens))], divider=True)
-        table.add_row(["output_tokens", str(
-            dict(self.output_tokens))], divider=True)
+        table.add_row(["input_tokens", str(self.input_tokens)], divider=True)
+        table.add_row(["output_tokens", str(self.output_tokens)], divider=True)
         table.add_row(["input_cost", f"${self.input_cost}"], divider=True)
         table.add_row(
             ["output_cost", f"${self.output_cost}"], divider=True)
@@ -38,6 +38,93 @@ class PipelineStatistics:
         return table.get_string()
 
 
+def _evaluation_columns(evaluation_fn: Callable) -> Optional[List[str]]:
+    """
+    Returns the columns `evaluation_fn` takes as keyword arguments, or None if it takes a row.
+
+    A function is treated as taking columns if all its parameters can be passed by keyword and it
+    has at least two of them, or any of them is keyword-only (e.g. `def is_correct(*, label)`).
+    Only functions whose parameters are all keyword-only are called with whole columns, see `_vectorized_eval`.
+    """
+    try:
+        parameters = inspect.signature(evaluation_fn).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    names = [p.name for p in parameters
+             if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+    if len(names) == 0 or len(names) != len(parameters):
+        return None
+    if len(names) < 2 and not any(p.kind == p.KEYWORD_ONLY for p in parameters):
+        return None
+    return names
+
+
+def _is_vectorized(evaluation_fn: Callable) -> bool:
+    """
+    Returns whether `evaluation_fn` opted in to being called with whole columns by making all its parameters keyword-only.
+    Other functions are only ever called once per row, since they may have side effects or be expensive (e.g. an LLM judge).
+    """
+    try:
+        parameters = inspect.signature(evaluation_fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return len(parameters) > 0 and all(p.kind == p.KEYWORD_ONLY for p in parameters)
+
+
+def _vectorized_eval(evaluation_fn: Callable, columns: Optional[List[str]], df: pd.DataFrame) -> Optional[np.ndarray]:
+    """
+    Calls `evaluation_fn` once with the given columns as numpy arrays.
+
+    Returns the results as a float array, or None if `evaluation_fn` isn't vectorized, raises,
+    or its output doesn't broadcast to one value per row.
+    """
+    if columns is None or not _is_vectorized(evaluation_fn) \
+            or any(c not in df.columns for c in columns):
+        return None
+    try:
+        results = np.asarray(evaluation_fn(
+            **{c: df[c].to_numpy() for c in columns}), dtype=float)
+    except Exception:
+        # not numpy-broadcastable, evaluate row by row instead
+        return None
+    if results.shape != (len(df),):
+        return None
+    return results
+
+
+def _row_eval(evaluation_fn: Callable, columns: Optional[List[str]], row: Union[pd.Series, Dict]):
+    """
+    Calls `evaluation_fn` on a single row, passing the given columns as keyword arguments if it takes them.
+    Columns missing from the row (e.g. outputs of a failed step) are passed as None.
+    """
+    if columns is None or all(c not in row for c in columns):
+        return evaluation_fn(row)
+    return evaluation_fn(**{c: row.get(c) for c in columns})
+
+
+def _overlaps(a: Optional[Set[str]], b: Optional[Set[str]]) -> bool:
+    # None means any field
+    return a is None or b is None or len(a & b) > 0
+
+
+def _overrides_run(step: Step) -> bool:
+    # a custom run can read and write anything, so it can't be split into _get_results and _assign_results
+    return type(step).run is not Step.run
+
+
+def _depends_on(step: Step, earlier_step: Step) -> bool:
+    """
+    Returns whether `step` must run after `earlier_step`, i.e. one writes a field that the other reads or writes.
+    Steps that override `run` depend on every step before them and every step after them depends on them.
+    """
+    if _overrides_run(step) or _overrides_run(earlier_step):
+        return True
+    reads, writes = step._read_fields(), step._written_fields()
+    earlier_reads, earlier_writes = earlier_step._read_fields(), earlier_step._written_fields()
+    return _overlaps(earlier_writes, reads) or _overlaps(earlier_writes, writes) \
+        or _overlaps(earlier_reads, writes)
+
+
 class Pipeline:
     """
     A class representing a pipeline of steps to process data.
@@ -45,14 +132,21 @@ class Pipeline:
     Attributes:
         steps (List[Step]): A list of steps (processing units) in the pipeline.
         evaluation_fn (Callable[[any], bool], optional): An optional function to evaluate the processed data.
+            Either takes a row, or takes two or more columns as keyword arguments (e.g. `lambda label, prediction: label == prediction`).
+            If all its parameters are keyword-only (e.g. `lambda *, label, prediction: label == prediction`), it is called once
+            with whole columns as numpy arrays, falling back to one call per row if that fails.
+            A function of a single column must declare it keyword-only (e.g. `def is_positive(*, label)`).
         data (Union[pd.DataFrame, Dict], optional): The data processed by the pipeline. Initially None.
         score (float, optional): The evaluation score of the processed data. Initially None.
         statistics (PipelineStatistics): Statistics of the pipeline's execution.
 
     Methods:
-        run(data): Applies the pipeline steps to the input data.
+        run(data, row_wise=True, concurrency=DEFAULT_CONCURRENCY): Applies the pipeline steps to the input data.
+            When not row-wise, the rows of a DataFrame are sent to LLM steps concurrently,
+            and steps that don't depend on each other (see Step.input_fields) run in parallel.
         update_params(params): Updates the parameters of the pipeline steps.
         evaluate(evaluation_fn=None): Evaluates the processed data using an evaluation function.
+        _step_statistics(): Returns the statistics recorded by each step.
         _aggregate_statistics(data): Aggregates statistics from the pipeline steps.
     """
 
@@ -72,12 +166,14 @@ class Pipeline:
         self.statistics = PipelineStatistics()
 
     def run_experiment(self, data, verbose=True, description=None):
+        eval_columns = _evaluation_columns(self.evaluation_fn)
+
         def run_steps(row: pd.Series):
             for step in self.steps:
                 step.run(row, verbose)
             if self.evaluation_fn is not None:
-                row[f"__{self.evaluation_fn.__name__}__"] = float(self.evaluation_fn(
-                    row))
+                row[f"__{self.evaluation_fn.__name__}__"] = float(
+                    _row_eval(self.evaluation_fn, eval_columns, row))
             return row
 
         if not studio_enabled():
@@ -117,18 +213,28 @@ class Pipeline:
             data: Union[pd.DataFrame, Dict],
             enable_logging=False,
             row_wise=True,
-            verbose=True):
+            verbose=True,
+            concurrency: int = DEFAULT_CONCURRENCY):
+        log_rows = row_wise and enable_logging and studio_enabled()
+        # row-wise dataframe runs without logging are evaluated in one pass by _evaluate
+        evaluate_rows = not isinstance(data, pd.DataFrame) or log_rows
+        if not evaluate_rows and self.evaluation_fn is not None:
+            # drop results from a previous run so that _evaluate recomputes them
+            data.drop(columns=f"__{self.evaluation_fn.__name__}__",
+                      errors="ignore", inplace=True)
+        eval_columns = _evaluation_columns(self.evaluation_fn)
+
         def run_steps(row):
             for step in self.steps:
                 step.run(row, verbose)
-            if self.evaluation_fn is not None:
-                row[f"__{self.evaluation_fn.__name__}__"] = float(self.evaluation_fn(
-                    row))
+            if self.evaluation_fn is not None and evaluate_rows:
+                row[f"__{self.evaluation_fn.__name__}__"] = float(
+                    _row_eval(self.evaluation_fn, eval_columns, row))
             return row
 
         # Note: currently running row-wise is ~40% slower than step-wise (because of memory overhead?)
         if row_wise:
-            if enable_logging and studio_enabled():
+            if log_rows:
                 from studio import run_pipeline_with_log
                 run_steps = run_pipeline_with_log(run_steps, self)
             if isinstance(data, pd.DataFrame):
@@ -143,13 +249,55 @@ class Pipeline:
                 run_steps(data)
         else:
             # logging not supported for step-wise execution
-            for step in self.steps:
-                step.run(data, verbose)
+            if isinstance(data, pd.DataFrame):
+                for layer in self._step_layers():
+                    self._run_layer(layer, data, verbose, concurrency)
+            else:
+                for step in self.steps:
+                    step.run(data, verbose)
 
         self._evaluate(data)
         self._aggregate_statistics(data)
         return data
 
+    def _step_layers(self) -> List[List[Step]]:
+        """
+        Groups the steps into layers of steps that don't depend on each other, in the order they must run.
+        A step goes in the layer after the last earlier step it depends on, so steps that don't declare
+        their input_fields run after all the steps before them.
+        """
+        levels = []
+        for i, step in enumerate(self.steps):
+            levels.append(max([levels[j] + 1 for j in range(i)
+                               if _depends_on(step, self.steps[j])], default=0))
+        layers = [[] for _ in range(max(levels) + 1)]
+        for step, level in zip(self.steps, levels):
+            layers[level].append(step)
+        return layers
+
+    def _run_layer(self, layer: List[Step], data: pd.DataFrame, verbose: bool, concurrency: int):
+        """
+        Runs a layer of independent steps on a DataFrame, each in its own thread. Results are assigned
+        to the DataFrame in step order once all steps are done, so steps only ever read the input data.
+        Steps that override `run` are always alone in their layer and are run as is.
+        """
+        if len(layer) == 1 and _overrides_run(layer[0]):
+            layer[0].run(data, verbose)
+            return
+
+        def get_results(step: Step):
+            # LLM calls are I/O bound, so make them for all rows concurrently
+            step_concurrency = concurrency if isinstance(step, LLMStep) else None
+            return step._get_results(data, verbose, step_concurrency)
+
+        if len(layer) == 1:
+            all_results = [get_results(layer[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(layer)) as executor:
+                all_results = list(executor.map(get_results, layer))
+        for step, results in zip(layer, all_results):
+            step._assign_results(data, results)
+
     def fingerprint(self, deep=False):
         fingerprint_obj = {
             "name": self.name,
@@ -182,45 +330,58 @@ class Pipeline:
             if f"__{fn_name}__" in data.columns:
                 results = data[f"__{fn_name}__"]
             else:
-                results = data.apply(
-                    lambda row: self.evaluation_fn(row), axis=1)
+                columns = _evaluation_columns(self.evaluation_fn)
+                results = _vectorized_eval(self.evaluation_fn, columns, data)
+                if results is None:
+                    results = data.apply(
+                        lambda row: float(_row_eval(self.evaluation_fn, columns, row)), axis=1)
                 data[f"__{fn_name}__"] = results
-            self.score = results.sum() / len(results)
+            self.score = float(np.mean(results))
         else:
             if f"__{fn_name}__" in data:
                 result = data[f"__{fn_name}__"]
             else:
-                result = float(self.evaluation_fn(data))
+                result = float(_row_eval(
+                    self.evaluation_fn, _evaluation_columns(self.evaluation_fn), data))
                 data[f"__{fn_name}__"] = result
             self.score = result
 
+    def _step_statistics(self) -> pd.DataFrame:
+        """
+        Returns the statistics recorded by each step as one row per step, along with the step's model for LLM steps.
+        """
+        # TODO: this needs to work for CustomSteps that make LLM calls too
+        # TODO: this assigns all tokens to the step's model, which is not true for composite step
+        return pd.DataFrame([{
+            "model": step.model if isinstance(step, LLMStep) else None,
+            **step.statistics.model_dump()
+        } for step in self.steps])
+
     def _aggregate_statistics(self, data: Union[pd.DataFrame, Dict]):
         self.statistics = PipelineStatistics()
         if self.score is not None:
             self.statistics.score = self.score
-        if isinstance(data, pd.DataFrame):
-            success = data.apply(lambda x: True, axis=1)
-        else:
-            success = True
-        for step in self.steps:
-            self.statistics.input_cost += step.statistics.input_cost
-            self.statistics.output_cost += step.statistics.output_cost
-            self.statistics.total_latency += step.statistics.total_latency
-            # TODO: this needs to work for CustomSteps that make LLM calls too
-            if isinstance(step, LLMStep) or isinstance(step, LLMStructuredStep) \
-                    or isinstance(step, LLMStructuredCompositeStep):
-                model = step.model
-                # TODO: this assumed that each step has a unique model which is not true for composite step
-                self.statistics.input_tokens[model] += step.statistics.input_tokens
-                self.statistics.output_tokens[model] += step.statistics.output_tokens
-
-                # TODO: success calculation needs to work for non LLM steps too
-                if isinstance(data, pd.DataFrame):
-                    success = success & data.apply(
-                        lambda x: x[f"__{step.name}__"]["success"], axis=1)
-                    self.statistics.num_success = success.sum()
-                    self.statistics.num_failure = len(
-                        data) - self.statistics.num_success
-                else:
-                    success = success & data[f"__{step.name}__"]["success"]
-                    self.statistics.num_success = 1 if success else 0
+        step_statistics = self._step_statistics()
+        self.statistics.input_cost = float(step_statistics["input_cost"].sum())
+        self.statistics.output_cost = float(
+            step_statistics["output_cost"].sum())
+        self.statistics.total_latency = float(
+            step_statistics["total_latency"].sum())
+        tokens = step_statistics.dropna(subset=["model"]).groupby(
+            "model", sort=False)[["input_tokens", "output_tokens"]].sum()
+        self.statistics.input_tokens = tokens["input_tokens"].to_dict()
+        self.statistics.output_tokens = tokens["output_tokens"].to_dict()
+
+        # TODO: success calculation needs to work for non LLM steps too
+        llm_steps = [step for step in self.steps if isinstance(step, LLMStep)]
+        if len(llm_steps) == 0:
+            return
+        num_rows = len(data) if isinstance(data, pd.DataFrame) else 1
+        success = np.ones(num_rows, dtype=bool)
+        for step in llm_steps:
+            if isinstance(data, pd.DataFrame):
+                success &= data[f"__{step.name}__success"].to_numpy(dtype=bool)
+            else:
+                success &= bool(data[f"__{step.name}__success"])
+        self.statistics.num_success = int(success.sum())
+        self.statistics.num_failure = num_rows - self.statistics.num_success
@@ -1,8 +1,11 @@
+import sys
+from functools import lru_cache
 from pydantic import BaseModel
 from typing import get_origin, get_args, get_type_hints
 import inspect
 
 
+@lru_cache(maxsize=256)
 def describe_pydantic_model(model_class: BaseModel, indent: str = ""):
     """
     Generates a string description of a Pydantic model including its fields, types, and descriptions.
@@ -19,30 +22,56 @@ def describe_pydantic_model(model_class: BaseModel, indent: str = ""):
         str: A formatted string describing the structure of the Pydantic model.
 
     Note:
+        The result is cached per (model_class, indent), since it's built for every prompt of a structured step.
         Currently, this function only handles lists of BaseModels, lists of primitives, BaseModels, and primitives.
         More complex types like Optional, Union, etc., are not yet supported.
     """
-    model_description = ""
-    fields = model_class.model_fields
-    for field_name, field_info in fields.items():
-        field_type = get_type_hints(model_class)[field_name]
-        field_type_parent = get_origin(field_type)
-        description = field_info.description or ""
+    parts = []
+    _describe(model_class, indent, parts)
+    return sys.intern("".join(parts))
+
+
+@lru_cache(maxsize=2048)
+def _is_pydantic_model(t) -> bool:
+    return inspect.isclass(t) and issubclass(t, BaseModel)
+
+
+@lru_cache(maxsize=256)
+def _field_types(model_class: BaseModel) -> tuple:
+    """
+    Returns (field_name, description, field_type, origin, args) for each field of `model_class`.
+    """
+    type_hints = get_type_hints(model_class)
+    return tuple(
+        (field_name, field_info.description or "", type_hints[field_name],
+         get_origin(type_hints[field_name]), get_args(type_hints[field_name]))
+        for field_name, field_info in model_class.model_fields.items())
+
+
+def _describe(model_class: BaseModel, indent: str, out: list):
+    """
+    Appends the description of each field of `model_class` to `out`. Nested models are described
+    by the (memoized) `describe_pydantic_model`.
+    """
+    for field_name, description, field_type, field_type_parent, field_type_args in _field_types(model_class):
+        prefix = f"{indent}- {field_name}"
 
         # TODO: handle more types.
         # Currently only handles lists of BaseModels, lists of primitives, BaseModels, and primitives)
         if field_type_parent is list:
-            element_type = get_args(field_type)[0]
-            if inspect.isclass(element_type) and issubclass(element_type, BaseModel):
-                model_description += f"{indent}- {field_name} (list): {description} \n Each item in this list should follow the structure:\n"
-                model_description += describe_pydantic_model(
-                    element_type, indent + "\t")
+            element_type = field_type_args[0]
+            if _is_pydantic_model(element_type):
+                out.append(
+                    f"{prefix} (list): {description} \n Each item in this list should follow the structure:\n")
+                out.append(describe_pydantic_model(
+                    element_type, indent + "\t"))
             else:
-                model_description += f"{indent}- {field_name} (list): {description} \n Each item in this list should be of type {element_type.__name__}\n"
-        elif inspect.isclass(field_type) and issubclass(field_type, BaseModel):
-            model_description += f"{indent}- {field_name} (obj): {description} \n This should follow the structure:\n"
-            model_description += describe_pydantic_model(
-                field_type, indent + "\t")
+                out.append(
+                    f"{prefix} (list): {description} \n Each item in this list should be of type {element_type.__name__}\n")
+        elif _is_pydantic_model(field_type):
+            out.append(
+                f"{prefix} (obj): {description} \n This should follow the structure:\n")
+            out.append(describe_pydantic_model(field_type, indent + "\t"))
         else:
-            model_description += f"{indent}- {field_name} ({field_type.__name__}): {description}\n"
-    return model_description
+            out.append(
+                f"{prefix} ({field_type.__name__}): {description}\n")
@@ -1,4 +1,4 @@
-from typing import Union, Dict, Callable, TypeVar, Generic
+from typing import Union, Dict, Callable, TypeVar, Generic, List
 from pydantic import BaseModel
 import pandas as pd
 from superpipe.steps.step import Step, StepResult
@@ -21,7 +21,8 @@ class CustomStep(Step, Generic[T]):
 
     def __init__(self,
                  transform: Callable[[Union[pd.Series, Dict]], Dict],
-                 name: str = None):
+                 name: str = None,
+                 input_fields: List[str] = None):
         """
         Initializes a new instance of the CustomStep class.
 
@@ -31,8 +32,10 @@ class CustomStep(Step, Generic[T]):
             out_schema (T): A Pydantic model that the output of the transform function should conform to.
 
             name (str, optional): An optional name for the step. Defaults to None.
+
+            input_fields (List[str], optional): The fields the transformation reads. Defaults to None, meaning any field.
         """
-        super().__init__(name)
+        super().__init__(name, input_fields)
         self.transform = transform
 
     def get_params(self):
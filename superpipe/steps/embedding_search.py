@@ -42,7 +42,8 @@ class EmbeddingSearchStep(Step):
                  candidates_fn: Optional[Callable[[
                      Union[Dict, pd.Series]], List[str]]] = None,
                  k: Optional[int] = DEFAULT_K,
-                 name=None):
+                 name=None,
+                 input_fields: Optional[List[str]] = None):
         """
         Initializes the embedding classification step with the necessary functions, candidates, and parameters.
 
@@ -56,8 +57,10 @@ class EmbeddingSearchStep(Step):
             k (Optional[int]): Number of nearest neighbors to use for classification. Defaults to 5.
 
             name (Optional[str]): Optional name for the step.
+
+            input_fields (Optional[List[str]]): The fields read by search_prompt and candidates_fn. Defaults to None, meaning any field.
         """
-        super().__init__(name)
+        super().__init__(name, input_fields)
         self.search_prompt = search_prompt
         self.embed_fn = embed_fn
         self.candidates = candidates
@@ -1,7 +1,7 @@
-from typing import Callable, Union, Dict
+from typing import Callable, Union, Dict, List
 import pandas as pd
 from superpipe.steps.step import Step, StepResult, StepRowStatistics
-from superpipe.llm import get_llm_response, LLMResponse
+from superpipe.llm import get_llm_response, get_llm_response_async, LLMResponse
 from openai.types.chat.completion_create_params import CompletionCreateParamsNonStreaming
 
 
@@ -23,7 +23,8 @@ class LLMStep(Step):
             model: str,
             prompt: Callable[[Union[Dict, pd.Series]], str],
             openai_args: CompletionCreateParamsNonStreaming = {},
-            name: str = None):
+            name: str = None,
+            input_fields: List[str] = None):
         """
         Initializes a new instance of the LLMStep class.
 
@@ -31,8 +32,9 @@ class LLMStep(Step):
             model (str): The identifier of the LLM to be used.
             prompt (Callable[[Union[Dict, pd.Series]], str]): A function that takes input data and returns a prompt string.
             name (str, optional): The name of the step. Defaults to None.
+            input_fields (List[str], optional): The fields read by the prompt function. Defaults to None, meaning any field.
         """
-        super().__init__(name)
+        super().__init__(name, input_fields)
         self.model = model
         self.prompt = prompt
         self.openai_args = openai_args
@@ -88,6 +90,26 @@ class LLMStep(Step):
             # TODO: need better error logging here include stacktrace
             response = LLMResponse(
                 success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, response)
+
+    async def _run_async(self, row: Union[pd.Series, Dict]) -> StepResult:
+        """
+        Async version of `_run`, used when running the step concurrently over many rows.
+        """
+        model = self.model
+        compiled_prompt = self.prompt(row)
+        openai_args = self.openai_args
+        try:
+            response = await get_llm_response_async(compiled_prompt, model, openai_args)
+        except Exception as e:
+            response = LLMResponse(
+                success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, response)
+
+    def _get_result(self, compiled_prompt: str, response: LLMResponse) -> StepResult:
+        """
+        Creates the StepResult for a row from the LLM's response.
+        """
         statistics = self._get_row_statistics(response)
         result = {}
         # TODO: how should we handle failure cases?
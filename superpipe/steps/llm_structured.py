@@ -1,8 +1,8 @@
-from typing import Callable, Union, Dict, TypeVar, Generic
+from typing import Callable, Union, Dict, TypeVar, Generic, List
 import pandas as pd
 from pydantic import BaseModel
 from openai.types.chat.completion_create_params import CompletionCreateParamsNonStreaming
-from superpipe.llm import get_structured_llm_response, StructuredLLMResponse
+from superpipe.llm import get_structured_llm_response, get_structured_llm_response_async, StructuredLLMResponse
 from superpipe.pydantic import describe_pydantic_model
 from superpipe.steps.llm_step import LLMStep, StepResult
 
@@ -38,7 +38,8 @@ class LLMStructuredStep(LLMStep, Generic[T]):
             prompt: Callable[[Union[Dict, pd.Series]], str],
             out_schema: T,
             openai_args: CompletionCreateParamsNonStreaming = {},
-            name: str = None):
+            name: str = None,
+            input_fields: List[str] = None):
         """
         Initializes a new instance of the LLMStructuredStep class.
 
@@ -47,8 +48,9 @@ class LLMStructuredStep(LLMStep, Generic[T]):
             prompt (Callable[[Union[Dict, pd.Series]], str]): A function that takes input data and returns a prompt string.
             out_schema (T): The Pydantic model that defines the expected structure of the LLM's response.
             name (str, optional): The name of the step. Defaults to None.
+            input_fields (List[str], optional): The fields read by the prompt function. Defaults to None, meaning any field.
         """
-        super().__init__(model, prompt, openai_args, name)
+        super().__init__(model, prompt, openai_args, name, input_fields)
         self.out_schema = out_schema
 
     def get_params(self):
@@ -91,7 +93,6 @@ class LLMStructuredStep(LLMStep, Generic[T]):
             Dict: The processed data, including the LLM's response and any extracted fields.
         """
         model = self.model
-        fields = self.out_schema.model_fields.keys()
         compiled_prompt = self._compile_structured_prompt(row)
         openai_args = self.openai_args
         try:
@@ -101,6 +102,28 @@ class LLMStructuredStep(LLMStep, Generic[T]):
             # TODO: need better error logging here include stacktrace
             response = StructuredLLMResponse(
                 success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, response)
+
+    async def _run_async(self, row: Union[pd.Series, Dict]) -> StepResult:
+        """
+        Async version of `_run`, used when running the step concurrently over many rows.
+        """
+        model = self.model
+        compiled_prompt = self._compile_structured_prompt(row)
+        openai_args = self.openai_args
+        try:
+            response = await get_structured_llm_response_async(
+                compiled_prompt, model, openai_args)
+        except Exception as e:
+            response = StructuredLLMResponse(
+                success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, response)
+
+    def _get_result(self, compiled_prompt: str, response: StructuredLLMResponse) -> StepResult:
+        """
+        Creates the StepResult for a row from the LLM's response, extracting the fields of `out_schema`.
+        """
+        fields = self.out_schema.model_fields.keys()
         statistics = self._get_row_statistics(response)
         result = {}
         # TODO: how should we handle failure cases
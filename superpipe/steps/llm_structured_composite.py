@@ -1,13 +1,16 @@
-from typing import Callable, Union, Dict, TypeVar, Generic
+from typing import Callable, Union, Dict, TypeVar, Generic, List
 import pandas as pd
 from pydantic import BaseModel
 from openai.types.chat.completion_create_params import CompletionCreateParamsNonStreaming
 from superpipe.llm import (
     get_structured_llm_response,
+    get_structured_llm_response_async,
     StructuredLLMResponse,
-    get_llm_response)
+    get_llm_response,
+    get_llm_response_async)
 from superpipe.pydantic import describe_pydantic_model
 from superpipe.steps.llm_step import LLMStep, StepResult
+from superpipe.steps.step import StepRowStatistics
 from superpipe.steps.utils import combine_step_row_statistics
 from superpipe.models import gpt35
 
@@ -30,7 +33,8 @@ class LLMStructuredCompositeStep(LLMStep, Generic[T]):
             out_schema: T,
             structured_model: str = gpt35,
             openai_args: CompletionCreateParamsNonStreaming = {},
-            name: str = None):
+            name: str = None,
+            input_fields: List[str] = None):
         """
         A pipeline step that uses a structured and an unstructured language model to process data.
         Use this step when the model or provider does not support JSON mode natively.
@@ -41,8 +45,9 @@ class LLMStructuredCompositeStep(LLMStep, Generic[T]):
             out_schema (T): Pydantic model defining the expected structured output.
             structured_model (str): Identifier for the structured LLM. Defaults to gpt35.
             name (str, optional): Name of the step.
+            input_fields (List[str], optional): Fields read by the prompt function. Defaults to None, meaning any field.
         """
-        super().__init__(model, prompt, openai_args, name)
+        super().__init__(model, prompt, openai_args, name, input_fields)
         self.structured_model = structured_model
         self.out_schema = out_schema
 
@@ -76,8 +81,9 @@ class LLMStructuredCompositeStep(LLMStep, Generic[T]):
         prompt = self.prompt
         structured_model = self.structured_model
         openai_args = self.openai_args
-        fields = self.out_schema.model_fields.keys()
         compiled_prompt = prompt(row)
+        # in case the first LLM call raises
+        statistics_first = StepRowStatistics(success=False)
         try:
             response = get_llm_response(compiled_prompt, model, openai_args)
             statistics_first = self._get_row_statistics(response)
@@ -93,6 +99,40 @@ class LLMStructuredCompositeStep(LLMStep, Generic[T]):
             # TODO: need better error logging here include stacktrace
             response = StructuredLLMResponse(
                 success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, statistics_first, response)
+
+    async def _run_async(self, row: Union[pd.Series, Dict]) -> StepResult:
+        """
+        Async version of `_run`, used when running the step concurrently over many rows.
+        """
+        model = self.model
+        prompt = self.prompt
+        structured_model = self.structured_model
+        openai_args = self.openai_args
+        compiled_prompt = prompt(row)
+        # in case the first LLM call raises
+        statistics_first = StepRowStatistics(success=False)
+        try:
+            response = await get_llm_response_async(compiled_prompt, model, openai_args)
+            statistics_first = self._get_row_statistics(response)
+            if response.success:
+                structured_prompt = self._compile_structured_prompt(
+                    response.content)
+                response = await get_structured_llm_response_async(
+                    structured_prompt, structured_model, openai_args)
+            else:
+                response = StructuredLLMResponse(
+                    success=False, error=response.error, latency=0)
+        except Exception as e:
+            response = StructuredLLMResponse(
+                success=False, error=str(e), latency=0)
+        return self._get_result(compiled_prompt, statistics_first, response)
+
+    def _get_result(self, compiled_prompt: str, statistics_first, response: StructuredLLMResponse) -> StepResult:
+        """
+        Creates the StepResult for a row from the structured LLM's response and the statistics of both LLM calls.
+        """
+        fields = self.out_schema.model_fields.keys()
         # TODO: combine model dumps of both LLM calls
         statistics_second = self._get_row_statistics(response)
         statistics = combine_step_row_statistics(
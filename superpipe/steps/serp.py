@@ -2,7 +2,7 @@ import os
 import requests
 import json
 import pandas as pd
-from typing import Callable, Union, Optional, Dict
+from typing import Callable, Union, Optional, Dict, List
 from superpipe.steps.step import Step, StepResult
 from superpipe.steps.utils import with_statistics
 
@@ -28,7 +28,8 @@ class SERPEnrichmentStep(Step):
     def __init__(self,
                  prompt: Callable[[Union[pd.Series, Dict]], str],
                  postprocess: Optional[Callable[[str], str]] = None,
-                 name=None):
+                 name=None,
+                 input_fields: Optional[List[str]] = None):
         """
         Initializes the SERPEnrichmentStep with a prompt function, an optional postprocess function, and an optional name.
 
@@ -37,8 +38,10 @@ class SERPEnrichmentStep(Step):
                 a row of data.
             postprocess (Optional[Callable[[str], str]]): An optional callable for post-processing the search results.
             name (Optional[str]): An optional name for the step.
+
+            input_fields (Optional[List[str]]): The fields read by the prompt function. Defaults to None, meaning any field.
         """
-        super().__init__(name)
+        super().__init__(name, input_fields)
         self.prompt = prompt
         self.postprocess = postprocess
 
@@ -1,9 +1,16 @@
+import asyncio
 import hashlib
 import pickle
-from typing import Union, Dict, Optional
+from typing import Union, Dict, Optional, List, Set
 from pydantic import BaseModel
+import numpy as np
 import pandas as pd
 from superpipe.config import is_dev
+from superpipe.clients import close_async_clients
+from superpipe.util import run_coroutine
+
+# maximum number of rows processed at once by Step.run_concurrently
+DEFAULT_CONCURRENCY = 64
 
 
 class StepStatistics(BaseModel):
@@ -41,21 +48,27 @@ class Step():
 
     Attributes:
         name (str): The name of the step. Defaults to the class name if not provided.
+        input_fields (List[str], optional): The fields the step reads. If None, the step is assumed to
+            read every field, and so always runs after all the steps before it.
 
     Methods:
         update_params(params): Updates the step's parameters with values from a dictionary.
         _run(row): Abstract method for applying the step's transformation to a single row.
+        _run_async(row): Optional async version of _run, used by run_concurrently.
         run(data): Applies the step's transformation to a DataFrame or dictionary.
+        run_concurrently(data, concurrency): Applies the step's transformation to the rows of a DataFrame concurrently.
     """
 
-    def __init__(self, name: str = None):
+    def __init__(self, name: str = None, input_fields: List[str] = None):
         """
         Initializes a new instance of the Step class.
 
         Args:
             name (str, optional): The name of the step. Defaults to the class name if None.
+            input_fields (List[str], optional): The fields the step reads. Defaults to None, meaning any field.
         """
         self.name = name or self.__class__.__name__
+        self.input_fields = input_fields
         self.reset_statistics()
 
     def reset_statistics(self):
@@ -75,6 +88,18 @@ class Step():
             return list(self.out_schema.model_fields.keys())
         return [self.name]
 
+    def _read_fields(self) -> Optional[Set[str]]:
+        """
+        Returns the fields the step reads, or None if it may read any field.
+        """
+        return set(self.input_fields) if self.input_fields is not None else None
+
+    def _written_fields(self) -> Optional[Set[str]]:
+        """
+        Returns the fields the step writes, including its metadata fields, or None if they're only known at runtime.
+        """
+        return {*self.output_fields(), f"__{self.name}__", f"__{self.name}__success"}
+
     def _update_statistics(self, statistics: StepRowStatistics):
         """
         Updates the statistics based on the response from the LLM.
@@ -147,6 +172,9 @@ class Step():
         is assigned back to the DataFrame. If the input is a dictionary, it is directly updated
         with the result of the transformation.
 
+        Metadata about each row's result is stored in a `__<name>__` field, and whether it
+        succeeded is also stored separately in a boolean `__<name>__success` field.
+
         Can be overridden in subclasses to provide custom behavior.
 
         Args:
@@ -155,33 +183,130 @@ class Step():
         Returns:
             Union[pd.DataFrame, Dict]: The transformed data.
         """
-        def get_metadata(result: StepResult):
-            return {
-                **result.statistics.model_dump(),
-                "error": result.error,
-                "prompt": result.input
-            }
         if isinstance(data, pd.DataFrame):
-            if verbose and is_dev:
-                from tqdm import tqdm
-                tqdm.pandas(desc=f"Applying step {self.name}")
-                results = data.progress_apply(self._run, axis=1)
-            else:
-                results = data.apply(self._run, axis=1)
-            for r in results:
-                self._update_statistics(r.statistics)
-            new_fields = pd.DataFrame([r.fields for r in results])
-            metadata = pd.DataFrame([get_metadata(r) for r in results])
-            data[new_fields.columns] = new_fields
-            data[f"__{self.name}__"] = metadata
+            self._assign_results(data, self._get_results(data, verbose))
         else:
             result = self._run(data)
             self._update_statistics(result.statistics)
             if isinstance(data, pd.Series):
                 for key, value in result.fields.items():
                     data.loc[key] = value
-                data.loc[f"__{self.name}__"] = get_metadata(result)
+                data.loc[f"__{self.name}__"] = self._get_metadata(result)
+                data.loc[f"__{self.name}__success"] = result.statistics.success
             else:
                 data.update(result.fields)
-                data[f"__{self.name}__"] = get_metadata(result)
+                data[f"__{self.name}__"] = self._get_metadata(result)
+                data[f"__{self.name}__success"] = result.statistics.success
         return data
+
+    async def _run_async(self, row: Union[pd.Series, Dict]) -> StepResult:
+        """
+        Async version of `_run`. Should be implemented by subclasses whose transformation is I/O bound
+        in order to support `run_concurrently`. Subclasses that override `_run` without also overriding
+        `_run_async` have `_run` run in a thread instead.
+
+        Args:
+            row (Union[pd.Series, Dict]): The data row to transform.
+
+        Returns:
+            StepResult: The result of the transformation.
+
+        Raises:
+            NotImplementedError: If the method is not overridden in a subclass.
+        """
+        raise NotImplementedError
+
+    def run_concurrently(self,
+                         data: Union[pd.DataFrame, Dict, pd.Series],
+                         verbose=True,
+                         concurrency: int = DEFAULT_CONCURRENCY):
+        """
+        Applies the step's transformation to the rows of a DataFrame concurrently using `_run_async`,
+        with at most `concurrency` rows in flight at once. Other inputs are passed through to `run`.
+
+        Args:
+            data (Union[pd.DataFrame, Dict]): The data to transform.
+            concurrency (int, optional): The maximum number of rows to process at once. Defaults to DEFAULT_CONCURRENCY.
+
+        Returns:
+            Union[pd.DataFrame, Dict]: The transformed data.
+        """
+        if not isinstance(data, pd.DataFrame) or type(self).run is not Step.run:
+            return self.run(data, verbose)
+        self._assign_results(data, self._get_results(
+            data, verbose, concurrency))
+        return data
+
+    def _get_results(self, data: pd.DataFrame, verbose=True, concurrency: Optional[int] = None) -> List[StepResult]:
+        """
+        Applies the step's transformation to each row of the DataFrame without modifying it.
+        Rows are processed one at a time with `_run` if `concurrency` is None, otherwise concurrently with `_run_async`.
+        """
+        if concurrency is not None:
+            rows = [row for _, row in data.iterrows()]
+            return run_coroutine(self._run_rows_async(rows, concurrency, verbose))
+        if verbose and is_dev:
+            from tqdm import tqdm
+            tqdm.pandas(desc=f"Applying step {self.name}")
+            results = data.progress_apply(self._run, axis=1)
+        else:
+            results = data.apply(self._run, axis=1)
+        return list(results)
+
+    async def _run_rows_async(self, rows: List[pd.Series], concurrency: int, verbose=True) -> List[StepResult]:
+        semaphore = asyncio.Semaphore(concurrency)
+        progress = None
+        if verbose and is_dev:
+            from tqdm import tqdm
+            progress = tqdm(total=len(rows), desc=f"Applying step {self.name}")
+
+        has_run_async = self._has_run_async()
+
+        async def run_row(row):
+            async with semaphore:
+                if has_run_async:
+                    result = await self._run_async(row)
+                else:
+                    result = await asyncio.to_thread(self._run, row)
+            if progress is not None:
+                progress.update()
+            return result
+
+        try:
+            return await asyncio.gather(*[run_row(row) for row in rows])
+        finally:
+            if progress is not None:
+                progress.close()
+            await close_async_clients()
+
+    def _has_run_async(self) -> bool:
+        """
+        Returns whether `_run_async` implements the step's transformation, i.e. it's overridden
+        in the same class as `_run` or in a subclass of it.
+        """
+        for cls in type(self).__mro__:
+            if "_run_async" in vars(cls):
+                return cls is not Step
+            if "_run" in vars(cls):
+                return False
+        return False
+
+    def _get_metadata(self, result: StepResult) -> Dict:
+        return {
+            **result.statistics.model_dump(),
+            "error": result.error,
+            "prompt": result.input
+        }
+
+    def _assign_results(self, data: pd.DataFrame, results: List[StepResult]):
+        """
+        Updates the statistics and assigns the output fields and metadata of each row's result to the DataFrame.
+        """
+        for r in results:
+            self._update_statistics(r.statistics)
+        new_fields = pd.DataFrame([r.fields for r in results], index=data.index)
+        data[new_fields.columns] = new_fields
+        data[f"__{self.name}__"] = pd.Series(
+            [self._get_metadata(r) for r in results], index=data.index)
+        data[f"__{self.name}__success"] = np.fromiter(
+            (r.statistics.success for r in results), dtype=bool, count=len(results))
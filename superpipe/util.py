@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from typing import TypedDict, Type, Dict, get_type_hints
 from pydantic import create_model
@@ -10,6 +12,19 @@ def validate_dict(dict: Dict, type: Type[TypedDict]) -> Dict:
     pydantic_model.model_validate(dict)
 
 
+def run_coroutine(coroutine):
+    """
+    Runs a coroutine to completion and returns its result.
+    If an event loop is already running (e.g. in a Jupyter notebook), the coroutine is run in a separate thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
 def gradient_color(val, min_val, median_val, max_val, reverse=False):
     if pd.isna(val):
         return 'background-color: white; color: black'  # Handle NaN values